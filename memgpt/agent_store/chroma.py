@@ -2,6 +2,7 @@ import chromadb
 import uuid
 import json
 import re
+import numpy as np
 from typing import Optional, List, Iterator, Dict
 from memgpt.agent_store.storage import StorageConnector, TableType
 from memgpt.utils import printd, datetime_to_timestamp, timestamp_to_datetime
@@ -183,6 +184,9 @@ class ChromaStorageConnector(StorageConnector):
 
     def query(self, query: str, query_vec: List[float], top_k: int = 10, filters: Optional[Dict] = {}) -> List[Record]:
         ids, filters = self.get_filters(filters)
+        # chroma only accepts embeddings as lists of floats
+        if isinstance(query_vec, np.ndarray):
+            query_vec = query_vec.tolist()
         results = self.collection.query(query_embeddings=[query_vec], n_results=top_k, include=self.include, where=filters)
 
         # flatten, since we only have one query vector
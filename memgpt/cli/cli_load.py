@@ -92,11 +92,19 @@ def store_docs(name, docs, user_id=None, show_progress=True):
     if user_id is None:  # assume running local with single user
         user_id = uuid.UUID(config.anon_clientid)
 
-    # ensure doc text is not too long
-    # TODO: replace this to instead split up docs that are too large
+    # ensure doc text is not too long, splitting up docs that are too large
     # (this is a temporary fix to avoid breaking the llama index)
+    split_docs = []
     for doc in docs:
-        doc.text = check_and_split_text(doc.text, config.default_embedding_config.embedding_model)[0]
+        # no overlap, since the node parser re-chunks the docs anyway (overlaps would be stored as duplicate passages)
+        texts = check_and_split_text(doc.text, config.default_embedding_config.embedding_model, stride=0)
+        if len(texts) == 1:
+            doc.text = texts[0]
+            split_docs.append(doc)
+        else:
+            # chunks keep the doc id of the document they came from
+            split_docs.extend([doc.copy(update={"text": text}) for text in texts])
+    docs = split_docs
 
     # record data source metadata
     ms = MetadataStore(config)
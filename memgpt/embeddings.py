@@ -1,8 +1,16 @@
 import typer
 import uuid
-from typing import Optional, List
+import asyncio
+import atexit
+import threading
+import importlib.util
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, List, Dict, Tuple, Union
 import os
 import numpy as np
+from tqdm import tqdm
 
 from memgpt.utils import is_valid_url, printd
 from memgpt.data_types import EmbeddingConfig
@@ -11,21 +19,184 @@ from memgpt.constants import MAX_EMBEDDING_DIM, EMBEDDING_TO_TOKENIZER_MAP, EMBE
 
 from llama_index.embeddings import OpenAIEmbedding, AzureOpenAIEmbedding
 from llama_index.bridge.pydantic import PrivateAttr
+from llama_index.callbacks.schema import CBEventType, EventPayload
 from llama_index.embeddings.base import BaseEmbedding
-from llama_index.embeddings.huggingface_utils import format_text
 import tiktoken
 
+try:
+    # optional faster (C++) implementation of tiktoken's BPE
+    import tokendagger
+except ImportError:
+    tokendagger = None
 
-def check_and_split_text(text: str, embedding_model: str) -> List[str]:
-    """Split text into chunks of max_length tokens or less"""
+try:
+    # optional faster json decoder (embedding payloads are large arrays of floats)
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # optional typed json decoder, used for embedding responses instead of parsing into dicts
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    # optional jit compiler for the query padding kernel
+    import numba
+except ImportError:
+    numba = None
+
+
+# http2 support in httpx is optional (requires the h2 package)
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# opt-in, since the event loops we create should behave the same as the host application's
+USE_UVLOOP = os.getenv("MEMGPT_UVLOOP") == "1"
+
+
+if msgspec is not None:
+
+    class EmbeddingItem(msgspec.Struct):
+        embedding: List[float]
+        index: int = 0
+
+    class EmbeddingResponse(msgspec.Struct):
+        data: List[EmbeddingItem]
+
+    # endpoints either return the embedding(s) directly, or wrapped in an openai-style response
+    _EMBEDDINGS_DECODER = msgspec.json.Decoder(Union[list, EmbeddingResponse])
+
+
+def _unexpected_payload(response) -> TypeError:
+    return TypeError(f"Got back an unexpected payload from text embedding function, response=\n{response.text}")
+
+
+def _decode_embeddings(response) -> list:
+    """Decode the json body of an embeddings response into a list of embeddings, in input order"""
+    if msgspec is not None:
+        # decode openai-style responses straight into typed structs, without building the intermediate dicts
+        try:
+            payload = _EMBEDDINGS_DECODER.decode(response.content)
+        except msgspec.DecodeError:
+            raise _unexpected_payload(response)
+        items = None if isinstance(payload, list) else [(item.index, item.embedding) for item in payload.data]
+    else:
+        payload = orjson.loads(response.content) if orjson is not None else response.json()
+        if isinstance(payload, list):
+            items = None
+        elif isinstance(payload, dict):
+            try:
+                items = [(item.get("index", 0), item["embedding"]) for item in payload["data"]]
+            except (KeyError, TypeError, AttributeError):
+                raise _unexpected_payload(response)
+        else:
+            # unknown response, can't parse
+            raise _unexpected_payload(response)
+
+    if items is None:
+        # embedding(s) directly in response, a single embedding being a flat list of floats
+        return [payload] if payload and not isinstance(payload[0], list) else payload
+    # TEI embeddings packaged inside openai-style response (not guaranteed to be in input order)
+    return [embedding for _, embedding in sorted(items, key=lambda item: item[0])]
+
+
+# sync clients shared by every endpoint in the process, keyed on (base_url, timeout)
+_CLIENT_POOL: Dict[Tuple[str, float], "httpx.Client"] = {}
+_CLIENT_POOL_LOCK = threading.Lock()
+
+
+def _get_client(base_url: str, timeout: float):
+    """Get the shared sync client for an endpoint, so connections stay warm across short-lived EmbeddingEndpoint objects"""
+    import httpx
+
+    key = (base_url, timeout)
+    client = _CLIENT_POOL.get(key)
+    if client is None:
+        with _CLIENT_POOL_LOCK:
+            client = _CLIENT_POOL.get(key)
+            if client is None:
+                client = httpx.Client(
+                    base_url=base_url,
+                    timeout=timeout,
+                    headers={"Content-Type": "application/json"},
+                    http2=HTTP2_AVAILABLE,
+                    limits=httpx.Limits(max_keepalive_connections=64),
+                )
+                _CLIENT_POOL[key] = client
+    return client
+
+
+def _close_clients():
+    with _CLIENT_POOL_LOCK:
+        for client in _CLIENT_POOL.values():
+            client.close()
+        _CLIENT_POOL.clear()
+
+
+atexit.register(_close_clients)
+
+
+def _run_async(coro):
+    """Run a coroutine to completion on a new event loop (a uvloop one if MEMGPT_UVLOOP=1)"""
+    if USE_UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            printd(
+                "Warning: MEMGPT_UVLOOP is set but uvloop is not installed (pip install 'pymemgpt[fast-embeddings]'), using the default event loop"
+            )
+        else:
+            # create the loop directly rather than with uvloop.install(), so the global loop policy is left alone
+            loop = uvloop.new_event_loop()
+            try:
+                return loop.run_until_complete(coro)
+            finally:
+                loop.run_until_complete(loop.shutdown_asyncgens())
+                loop.close()
+    return asyncio.run(coro)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name: str):
+    """Load a tiktoken encoding once per process instead of on every call (backed by TokenDagger if it's installed)"""
+    encoding = tiktoken.get_encoding(encoding_name)
+    if tokendagger is not None:
+        try:
+            return tokendagger.Tokenizer(
+                name=encoding.name,
+                pat_str=encoding._pat_str,
+                mergeable_ranks=encoding._mergeable_ranks,
+                special_tokens=encoding._special_tokens,
+            )
+        except Exception as e:
+            printd(f"Warning: couldn't load TokenDagger tokenizer for {encoding_name}, falling back to tiktoken: {e}")
+    return encoding
+
+
+def _snap_to_char_boundary(encoding, token_ids: List[int], i: int) -> int:
+    """Move a split point back until it doesn't fall inside a multi-byte UTF-8 character (byte-level BPE tokens can end mid-character)"""
+    if hasattr(encoding, "decode_single_token_bytes"):
+        token_bytes = encoding.decode_single_token_bytes
+    else:
+        # TokenDagger tokenizers only decode lists of tokens
+        def token_bytes(token: int) -> bytes:
+            return encoding.decode_bytes([token])
+
+    # continuation bytes look like 0b10xxxxxx, and a character is at most 4 bytes (so this only ever steps back 3 tokens)
+    while 0 < i < len(token_ids) and token_bytes(token_ids[i])[0] & 0xC0 == 0x80:
+        i -= 1
+    return i
+
+
+def check_and_split_text(text: str, embedding_model: str, stride: Optional[int] = None) -> List[str]:
+    """Split text into chunks of max_length tokens or less, consecutive chunks overlapping by stride tokens (max_length // 8 by default)"""
 
     if embedding_model in EMBEDDING_TO_TOKENIZER_MAP:
-        encoding = tiktoken.get_encoding(EMBEDDING_TO_TOKENIZER_MAP[embedding_model])
+        encoding = _get_encoding(EMBEDDING_TO_TOKENIZER_MAP[embedding_model])
     else:
         print(f"Warning: couldn't find tokenizer for model {embedding_model}, using default tokenizer {EMBEDDING_TO_TOKENIZER_DEFAULT}")
-        encoding = tiktoken.get_encoding(EMBEDDING_TO_TOKENIZER_DEFAULT)
-
-    num_tokens = len(encoding.encode(text))
+        encoding = _get_encoding(EMBEDDING_TO_TOKENIZER_DEFAULT)
 
     # determine max length
     if hasattr(encoding, "max_length"):
@@ -35,13 +206,103 @@ def check_and_split_text(text: str, embedding_model: str) -> List[str]:
         printd(f"Warning: couldn't find max_length for tokenizer {embedding_model}, using default max_length 8191")
         max_length = 8191
 
-    # truncate text if too long
-    if num_tokens > max_length:
-        # TODO: split this into two pieces of text instead of truncating
-        print(f"Warning: text is too long ({num_tokens} tokens), truncating to {max_length} tokens.")
-        text = format_text(text, embedding_model, max_length=max_length)
+    # encode in pieces of at most max_length * 8 characters, which bounds tiktoken's superlinear runtime on very long inputs
+    segment_length = max_length * 8
+    token_ids = []
+    for i in range(0, len(text), segment_length):
+        token_ids.extend(encoding.encode(text[i : i + segment_length]))
+    num_tokens = len(token_ids)
+
+    if num_tokens <= max_length:
+        return [text]
+
+    # split text into overlapping windows of max_length tokens, so the tail of long texts isn't lost
+    printd(f"Warning: text is too long ({num_tokens} tokens), splitting into chunks of {max_length} tokens.")
+    if stride is None:
+        stride = max_length // 8
+    chunks = []
+    start = 0
+    while True:
+        end = _snap_to_char_boundary(encoding, token_ids, min(start + max_length, num_tokens))
+        chunks.append(encoding.decode(token_ids[start:end]))
+        # (stop at the end of the text, rather than adding a window that would only repeat the overlap)
+        if end == num_tokens:
+            return chunks
+        next_start = _snap_to_char_boundary(encoding, token_ids, end - stride)
+        start = next_start if next_start > start else end
+
+
+class EmbeddingCache:
+    """Exact-match cache of embeddings, held in memory (LRU) and optionally persisted on disk"""
+
+    def __init__(self, maxsize: int = 4096, cache_dir: Optional[str] = None):
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+        # the cache is shared by every endpoint (in every thread) with the same base_url and model
+        self._lock = threading.Lock()
+        self._disk = None
+        if cache_dir is not None:
+            try:
+                import diskcache
+
+                self._disk = diskcache.Cache(cache_dir)
+            except ImportError:
+                print(f"Warning: diskcache is not installed, embeddings will not be cached in {cache_dir}")
+
+    @staticmethod
+    def key(base_url: str, model_name: str, text: str):
+        # disk caches can be shared between servers, which may serve different models under the same name
+        return (base_url, model_name, hashlib.blake2b(text.encode(), digest_size=16).digest())
+
+    def get(self, key) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+        if embedding is None and self._disk is not None:
+            embedding = self._disk.get(key)
+            if embedding is not None:
+                embedding = np.asarray(embedding, dtype=np.float32)
+                embedding.setflags(write=False)
+                self._put_memory(key, embedding)
+        return embedding
 
-    return [text]
+    def put(self, key, embedding: np.ndarray):
+        # stored at full precision, so a hit returns exactly what the miss that filled it did
+        embedding = np.asarray(embedding, dtype=np.float32)
+        # cached arrays are shared between callers, so make sure nobody modifies them in place
+        embedding.setflags(write=False)
+        self._put_memory(key, embedding)
+        if self._disk is not None:
+            self._disk.set(key, embedding)
+
+    def _put_memory(self, key, embedding: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+
+# embedding caches shared by every endpoint in the process, keyed on (base_url, model_name, maxsize, cache_dir)
+_CACHE_POOL: Dict[Tuple[str, str, int, Optional[str]], EmbeddingCache] = {}
+_CACHE_POOL_LOCK = threading.Lock()
+
+
+def _get_cache(base_url: str, model_name: str, maxsize: int, cache_dir: Optional[str]) -> EmbeddingCache:
+    """Get the shared embedding cache for an endpoint's model, so hits survive short-lived EmbeddingEndpoint objects"""
+    # (endpoints asking for a different cache size, e.g. 0 to disable it, get a cache of their own)
+    key = (base_url, model_name, maxsize, cache_dir)
+    cache = _CACHE_POOL.get(key)
+    if cache is None:
+        with _CACHE_POOL_LOCK:
+            cache = _CACHE_POOL.get(key)
+            if cache is None:
+                cache = EmbeddingCache(maxsize=maxsize, cache_dir=cache_dir)
+                _CACHE_POOL[key] = cache
+    return cache
 
 
 class EmbeddingEndpoint(BaseEmbedding):
@@ -53,6 +314,8 @@ class EmbeddingEndpoint(BaseEmbedding):
     _user: str = PrivateAttr()
     _timeout: float = PrivateAttr()
     _base_url: str = PrivateAttr()
+    _max_concurrency: int = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
 
     def __init__(
         self,
@@ -60,6 +323,10 @@ class EmbeddingEndpoint(BaseEmbedding):
         base_url: str,
         user: str,
         timeout: float = 60.0,
+        embed_batch_size: int = 64,
+        max_concurrency: int = 32,
+        cache_size: int = 4096,
+        cache_dir: Optional[str] = None,
     ):
         if not is_valid_url(base_url):
             raise ValueError(
@@ -68,8 +335,11 @@ class EmbeddingEndpoint(BaseEmbedding):
         self._user = user
         self._base_url = base_url
         self._timeout = timeout
+        self._max_concurrency = max_concurrency
+        self._cache = _get_cache(base_url, model, cache_size, cache_dir)
         super().__init__(
             model_name=model,
+            embed_batch_size=embed_batch_size,
         )
 
     @classmethod
@@ -77,111 +347,389 @@ class EmbeddingEndpoint(BaseEmbedding):
         return "EmbeddingEndpoint"
 
     def _call_api(self, text: str) -> List[float]:
-        if not is_valid_url(self._base_url):
-            raise ValueError(
-                f"Embeddings endpoint does not have a valid URL (set to: '{self._base_url}'). Make sure embedding_endpoint is set correctly in your MemGPT config."
-            )
+        json_data = {"input": text, "model": self.model_name, "user": self._user}
+        response = _get_client(self._base_url, self._timeout).post("/embeddings", json=json_data)
+
+        return self._parse_response(response)
+
+    def _new_async_client(self):
+        """Create an async client for the running event loop, pooling up to max_concurrency connections"""
         import httpx
 
+        limits = httpx.Limits(max_connections=self._max_concurrency, max_keepalive_connections=self._max_concurrency)
+        return httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=limits)
+
+    async def _apost(self, json_data: dict, client, sem: asyncio.Semaphore):
         headers = {"Content-Type": "application/json"}
-        json_data = {"input": text, "model": self.model_name, "user": self._user}
 
-        with httpx.Client() as client:
-            response = client.post(
+        async with sem:
+            return await client.post(
                 f"{self._base_url}/embeddings",
                 headers=headers,
                 json=json_data,
                 timeout=self._timeout,
             )
 
-        response_json = response.json()
+    async def _acall_api(self, text: str, client, sem: asyncio.Semaphore) -> List[float]:
+        json_data = {"input": text, "model": self.model_name, "user": self._user}
+        response = await self._apost(json_data, client, sem)
+
+        return self._parse_response(response)
+
+    def _parse_response(self, response) -> List[float]:
+        return self._parse_batch(response, 1)[0]
+
+    def _parse_batch(self, response, num_texts: int) -> List[List[float]]:
+        embeddings = _decode_embeddings(response)
+        if len(embeddings) != num_texts:
+            raise TypeError(f"Expected {num_texts} embeddings from text embedding function, got {len(embeddings)}")
+        return embeddings
+
+    def _call_api_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts with a single request"""
+        json_data = {"input": texts, "model": self.model_name, "user": self._user}
+        response = _get_client(self._base_url, self._timeout).post("/embeddings", json=json_data)
+
+        return self._parse_batch(response, len(texts))
+
+    async def _acall_api_batch(self, texts: List[str], client, sem: asyncio.Semaphore) -> List[List[float]]:
+        """Embed a list of texts with a single request, through an async client (and a semaphore bounding requests through it)"""
+        json_data = {"input": texts, "model": self.model_name, "user": self._user}
+        response = await self._apost(json_data, client, sem)
+
+        return self._parse_batch(response, len(texts))
+
+    def _split_batches(self, texts: List[str]):
+        """Bucket texts of similar length together, so the server wastes as little work as possible padding each batch"""
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        batches = [sorted_texts[i : i + self.embed_batch_size] for i in range(0, len(sorted_texts), self.embed_batch_size)]
+        return order, batches
+
+    def _unsort_batches(self, order, batches: List[List[List[float]]]) -> np.ndarray:
+        """Scatter the embeddings of the length-sorted batches back into the original order of the texts"""
+        embeddings = np.asarray([embedding for batch in batches for embedding in batch], dtype=np.float32)
+        inv = np.empty_like(order)
+        inv[order] = np.arange(len(order))
+        return embeddings[inv]
+
+    async def _abatch(self, texts: List[str], show_progress: bool = False) -> np.ndarray:
+        """Embed all texts, sending one request per batch of embed_batch_size texts (at most max_concurrency in flight)"""
+        order, batches = self._split_batches(texts)
+        results = [None] * len(batches)
+
+        async def embed_batch(i, batch, client, sem):
+            results[i] = await self._acall_api_batch(batch, client, sem)
+
+        # clients and semaphores are bound to the event loop they are used on, and the same endpoint can be driven
+        # from several threads (each with its own loop), so every run gets its own and closes it when done
+        sem = asyncio.Semaphore(self._max_concurrency)
+        async with self._new_async_client() as client:
+            # started in order (as_completed would schedule bare coroutines in arbitrary order), but they finish out of
+            # order, so the progress bar ticks as each one completes
+            tasks = [asyncio.ensure_future(embed_batch(i, batch, client, sem)) for i, batch in enumerate(batches)]
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Generating embeddings", disable=not show_progress):
+                await task
+        return self._unsort_batches(order, results)
+
+    def _cached_call_api(self, text: str) -> np.ndarray:
+        key = EmbeddingCache.key(self._base_url, self.model_name, text)
+        embedding = self._cache.get(key)
+        if embedding is None:
+            embedding = np.asarray(self._call_api(text), dtype=np.float32)
+            self._cache.put(key, embedding)
+        return embedding
 
-        if isinstance(response_json, list):
-            # embedding directly in response
-            embedding = response_json
-        elif isinstance(response_json, dict):
-            # TEI embedding packaged inside openai-style response
+    def _lookup_cache(self, texts: List[str]):
+        """Get the cached embeddings of texts, along with the indices of the texts that still need to be embedded"""
+        keys = [EmbeddingCache.key(self._base_url, self.model_name, text) for text in texts]
+        embeddings = [self._cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        return keys, embeddings, missing
+
+    def _fill_cache(self, keys, embeddings: list, missing: List[int], new_embeddings: np.ndarray) -> List[List[float]]:
+        for i, embedding in zip(missing, new_embeddings):
+            self._cache.put(keys[i], embedding)
+            embeddings[i] = embedding
+        # NOTE: llama index validates node embeddings as lists, so batches can't be handed back as arrays
+        return [embedding.tolist() for embedding in embeddings]
+
+    def _embed_batches(self, texts: List[str], show_progress: bool = False) -> np.ndarray:
+        if len(texts) > self.embed_batch_size:
             try:
-                embedding = response_json["data"][0]["embedding"]
-            except (KeyError, IndexError):
-                raise TypeError(f"Got back an unexpected payload from text embedding function, response=\n{response_json}")
-        else:
-            # unknown response, can't parse
-            raise TypeError(f"Got back an unexpected payload from text embedding function, response=\n{response_json}")
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # no event loop running in this thread, so we can drive the requests concurrently
+                return _run_async(self._abatch(texts, show_progress))
+        # a single request isn't worth a new event loop and async client (with fresh connections), so it goes through the
+        # shared sync client, as do all requests inside a running loop (asyncio.run can't be nested, e.g. in the server)
+        order, batches = self._split_batches(texts)
+        batches = tqdm(batches, desc="Generating embeddings", disable=not show_progress)
+        return self._unsort_batches(order, [self._call_api_batch(batch) for batch in batches])
+
+    def _get_query_embedding(self, query: str) -> np.ndarray:
+        """get query embedding."""
+        embedding = self._cached_call_api(query)
+        return embedding
 
+    def _get_text_embedding(self, text: str) -> np.ndarray:
+        """get text embedding."""
+        embedding = self._cached_call_api(text)
         return embedding
 
-    async def _acall_api(self, text: str) -> List[float]:
-        if not is_valid_url(self._base_url):
-            raise ValueError(
-                f"Embeddings endpoint does not have a valid URL (set to: '{self._base_url}'). Make sure embedding_endpoint is set correctly in your MemGPT config."
-            )
-        import httpx
+    def _get_text_embeddings(self, texts: List[str], show_progress: bool = False) -> List[List[float]]:
+        keys, embeddings, missing = self._lookup_cache(texts)
+        new_embeddings = self._embed_batches([texts[i] for i in missing], show_progress) if missing else []
+        return self._fill_cache(keys, embeddings, missing, new_embeddings)
 
-        headers = {"Content-Type": "application/json"}
-        json_data = {"input": text, "model": self.model_name, "user": self._user}
+    async def _aget_query_embedding(self, query: str) -> np.ndarray:
+        return self._get_query_embedding(query)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self._base_url}/embeddings",
-                headers=headers,
-                json=json_data,
-                timeout=self._timeout,
-            )
-        response_json = response.json()
+    async def _aget_text_embedding(self, text: str) -> np.ndarray:
+        return self._get_text_embedding(text)
+
+    async def _aget_text_embeddings(self, texts: List[str], show_progress: bool = False) -> List[List[float]]:
+        keys, embeddings, missing = self._lookup_cache(texts)
+        new_embeddings = await self._abatch([texts[i] for i in missing], show_progress) if missing else []
+        return self._fill_cache(keys, embeddings, missing, new_embeddings)
 
-        if isinstance(response_json, list):
-            # embedding directly in response
-            embedding = response_json
-        elif isinstance(response_json, dict):
-            # TEI embedding packaged inside openai-style response
+    # NOTE: llama index cuts the texts into embed_batch_size pieces before they reach _get_text_embeddings, which would
+    # leave nothing to bucket by length (or send concurrently), so the whole list is handed over in one go instead
+
+    def get_text_embedding_batch(self, texts: List[str], show_progress: bool = False, **kwargs: Any) -> List[List[float]]:
+        """Get a list of text embeddings, batched by length"""
+        with self.callback_manager.event(CBEventType.EMBEDDING, payload={EventPayload.SERIALIZED: self.to_dict()}) as event:
+            embeddings = self._get_text_embeddings(texts, show_progress)
+            event.on_end(payload={EventPayload.CHUNKS: texts, EventPayload.EMBEDDINGS: embeddings})
+        return embeddings
+
+    async def aget_text_embedding_batch(self, texts: List[str], show_progress: bool = False) -> List[List[float]]:
+        """Asynchronously get a list of text embeddings, batched by length"""
+        with self.callback_manager.event(CBEventType.EMBEDDING, payload={EventPayload.SERIALIZED: self.to_dict()}) as event:
+            embeddings = await self._aget_text_embeddings(texts, show_progress)
+            event.on_end(payload={EventPayload.CHUNKS: texts, EventPayload.EMBEDDINGS: embeddings})
+        return embeddings
+
+
+class CoalescingEmbeddingEndpoint:
+
+    """Coalesces concurrent single-text embedding requests into batched calls to an EmbeddingEndpoint"""
+
+    def __init__(self, endpoint: EmbeddingEndpoint, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.endpoint = endpoint
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = None
+        self._worker = None
+        self._worker_loop = None
+        self._client = None
+        self._sem = None
+        self._batch_tasks = set()
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._client is not None and self._worker_loop is not loop:
+            # queues, tasks, clients and semaphores all belong to a single event loop, and the open client's connections
+            # can only be closed from the loop they were made on
+            raise RuntimeError("CoalescingEmbeddingEndpoint is in use on another event loop, aclose() it there before reusing it")
+        if self._client is None:
+            self._client = self.endpoint._new_async_client()
+            self._sem = asyncio.Semaphore(self.endpoint._max_concurrency)
+            self._worker_loop = loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed a single text, batched together with any other texts requested at the same time"""
+        embedding = self.endpoint._cache.get(EmbeddingCache.key(self.endpoint._base_url, self.endpoint.model_name, text))
+        if embedding is not None:
+            return embedding
+
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def aclose(self):
+        """Stop the background worker, letting the batches already sent finish and failing the requests not sent yet"""
+        if self._worker is not None:
+            self._worker.cancel()
             try:
-                embedding = response_json["data"][0]["embedding"]
-            except (KeyError, IndexError):
-                raise TypeError(f"Got back an unexpected payload from text embedding function, response=\n{response_json}")
-        else:
-            # unknown response, can't parse
-            raise TypeError(f"Got back an unexpected payload from text embedding function, response=\n{response_json}")
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+        # otherwise callers still waiting on queued texts would never return
+        if self._queue is not None:
+            items = []
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            self._fail(items, RuntimeError("CoalescingEmbeddingEndpoint was closed before the text was embedded"))
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _fail(items, e: Exception):
+        for _, future in items:
+            if not future.done():
+                future.set_exception(e)
+
+    async def _run(self):
+        while True:
+            items = [await self._queue.get()]
+            try:
+                if self._queue.qsize() < self.max_batch_size - 1:
+                    # give other concurrent requests a moment to arrive
+                    await asyncio.sleep(self.max_wait_ms / 1000)
+            except asyncio.CancelledError:
+                # closed while collecting the batch
+                self._fail(items, RuntimeError("CoalescingEmbeddingEndpoint was closed before the text was embedded"))
+                raise
+            while len(items) < self.max_batch_size and not self._queue.empty():
+                items.append(self._queue.get_nowait())
 
-        return embedding
+            # don't wait for the request to finish before collecting the next batch (the endpoint bounds concurrency)
+            task = asyncio.get_running_loop().create_task(self._embed_batch(items))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _embed_batch(self, items):
+        texts = [text for text, _ in items]
+        try:
+            embeddings = np.asarray(await self.endpoint._acall_api_batch(texts, self._client, self._sem), dtype=np.float32)
+        except Exception as e:
+            self._fail(items, e)
+            return
+
+        for (text, future), embedding in zip(items, embeddings):
+            self.endpoint._cache.put(EmbeddingCache.key(self.endpoint._base_url, self.endpoint.model_name, text), embedding)
+            if not future.done():
+                future.set_result(embedding)
+
+
+# inference engines shared by every BatchedInferenceEmbedding in the process, keyed on (model, device)
+_INFERENCE_POOL: Dict[Tuple[str, str], Any] = {}
+_INFERENCE_POOL_LOCK = threading.Lock()
+
+
+def _get_batched_inference(model: str, device: str):
+    """Get the shared inference engine for a model, so its weights and worker threads are only loaded once per process"""
+    from embed import BatchedInference
+
+    key = (model, device)
+    with _INFERENCE_POOL_LOCK:
+        register = _INFERENCE_POOL.get(key)
+        if register is None:
+            register = BatchedInference(model_id=[model], engine="torch", device=device)
+            _INFERENCE_POOL[key] = register
+    return register
+
+
+def _stop_batched_inference():
+    with _INFERENCE_POOL_LOCK:
+        for register in _INFERENCE_POOL.values():
+            register.stop()
+        _INFERENCE_POOL.clear()
+
+
+atexit.register(_stop_batched_inference)
+
+
+class BatchedInferenceEmbedding(BaseEmbedding):
 
-    def _get_query_embedding(self, query: str) -> list[float]:
+    """Local embedding model run by the embed (infinity) library, which batches concurrent requests together"""
+
+    _register = PrivateAttr()
+
+    def __init__(self, model: str, device: Optional[str] = None):
+        if device is None:
+            import torch
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self._register = _get_batched_inference(model, device)
+        super().__init__(
+            model_name=model,
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedInferenceEmbedding"
+
+    def _embed(self, texts: List[str]):
+        # returns a concurrent.futures.Future of (embeddings, token usage)
+        return self._register.embed(sentences=texts, model_id=self.model_name)
+
+    def _get_query_embedding(self, query: str) -> np.ndarray:
         """get query embedding."""
-        embedding = self._call_api(query)
-        return embedding
+        embeddings, _ = self._embed([query]).result()
+        return np.asarray(embeddings[0], dtype=np.float32)
 
-    def _get_text_embedding(self, text: str) -> list[float]:
+    def _get_text_embedding(self, text: str) -> np.ndarray:
         """get text embedding."""
-        embedding = self._call_api(text)
-        return embedding
+        embeddings, _ = self._embed([text]).result()
+        return np.asarray(embeddings[0], dtype=np.float32)
 
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        embeddings = [self._get_text_embedding(text) for text in texts]
-        return embeddings
+        embeddings, _ = self._embed(texts).result()
+        # NOTE: llama index validates node embeddings as lists, so batches can't be handed back as arrays
+        return np.asarray(embeddings, dtype=np.float32).tolist()
 
-    async def _aget_query_embedding(self, query: str) -> List[float]:
-        return self._get_query_embedding(query)
+    async def _aget_query_embedding(self, query: str) -> np.ndarray:
+        embeddings, _ = await asyncio.wrap_future(self._embed([query]))
+        return np.asarray(embeddings[0], dtype=np.float32)
 
-    async def _aget_text_embedding(self, text: str) -> List[float]:
-        return self._get_text_embedding(text)
+    async def _aget_text_embedding(self, text: str) -> np.ndarray:
+        embeddings, _ = await asyncio.wrap_future(self._embed([text]))
+        return np.asarray(embeddings[0], dtype=np.float32)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings, _ = await asyncio.wrap_future(self._embed(texts))
+        return np.asarray(embeddings, dtype=np.float32).tolist()
 
 
 def default_embedding_model():
     # default to hugging face model running local
     # warning: this is a terrible model
-    from llama_index.embeddings import HuggingFaceEmbedding
-
     os.environ["TOKENIZERS_PARALLELISM"] = "False"
     model = "BAAI/bge-small-en-v1.5"
+
+    if os.getenv("MEMGPT_FAST_LOCAL_EMBED") == "1":
+        # same model, but with dynamic batching (and flash attention where supported)
+        try:
+            return BatchedInferenceEmbedding(model=model)
+        except ImportError:
+            print(
+                "Warning: MEMGPT_FAST_LOCAL_EMBED is set but the embed package is not installed (pip install 'pymemgpt[fast-local-embed]'), falling back to HuggingFaceEmbedding"
+            )
+
+    from llama_index.embeddings import HuggingFaceEmbedding
+
     return HuggingFaceEmbedding(model_name=model)
 
 
-def query_embedding(embedding_model, query_text: str):
+def _pad_embedding(vec: np.ndarray, out: np.ndarray) -> None:
+    """Copy vec into the start of out and zero the rest"""
+    out[: vec.size] = vec
+    out[vec.size :] = 0
+
+
+if numba is not None:
+    _pad_embedding = numba.njit(cache=True)(_pad_embedding)
+
+
+def query_embedding(embedding_model, query_text: str) -> np.ndarray:
     """Generate padded embedding for querying database"""
-    query_vec = embedding_model.get_text_embedding(query_text)
-    query_vec = np.array(query_vec)
-    query_vec = np.pad(query_vec, (0, MAX_EMBEDDING_DIM - query_vec.shape[0]), mode="constant").tolist()
-    return query_vec
+    # EmbeddingEndpoint returns float32 arrays already (no copy), other (llama index) models return lists
+    query_vec = np.asarray(embedding_model.get_text_embedding(query_text), dtype=np.float32)
+    # write straight into a full-size buffer rather than allocating an array and then a padded copy of it
+    padded_vec = np.empty(MAX_EMBEDDING_DIM, dtype=np.float32)
+    _pad_embedding(query_vec, padded_vec)
+    # returned as an array, left to each vector store to convert to what it binds (pgvector and chroma both take it via tolist())
+    return padded_vec
 
 
 def embedding_model(config: EmbeddingConfig, user_id: Optional[uuid.UUID] = None):
@@ -0,0 +1,543 @@
+import asyncio
+import json
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import memgpt.embeddings
+from memgpt.constants import MAX_EMBEDDING_DIM
+from memgpt.embeddings import (
+    BatchedInferenceEmbedding,
+    CoalescingEmbeddingEndpoint,
+    EmbeddingCache,
+    EmbeddingEndpoint,
+    check_and_split_text,
+    query_embedding,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_embedding_caches():
+    # caches are shared across endpoints, so each test starts from an empty one
+    memgpt.embeddings._CACHE_POOL.clear()
+
+
+def fake_embedding(text):
+    return [float(len(text)), 1.0]
+
+
+def test_get_text_embeddings_batches_requests(monkeypatch):
+    requests = []
+
+    async def fake_acall_api_batch(self, texts, client, sem):
+        requests.append(texts)
+        # finish the longest batches first to make sure results are not returned in completion order
+        await asyncio.sleep(0.001 * (10 - len(texts[0])))
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_acall_api_batch", fake_acall_api_batch)
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=2)
+    texts = ["a", "bbbbb", "cc", "ddddddd", "eee"]
+    assert embed_model._get_text_embeddings(texts) == [fake_embedding(text) for text in texts]
+    # texts are bucketed by length before batching
+    assert requests == [["a", "cc"], ["eee", "bbbbb"], ["ddddddd"]]
+    assert asyncio.run(embed_model._aget_text_embeddings(texts)) == [fake_embedding(text) for text in texts]
+
+
+def test_get_text_embedding_batch_buckets_whole_input(monkeypatch):
+    requests = []
+
+    async def fake_acall_api_batch(self, texts, client, sem):
+        requests.append(texts)
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_acall_api_batch", fake_acall_api_batch)
+
+    texts = ["a", "bbbbb", "cc", "ddddddd", "eee"]
+    # through the public llama index api, which would otherwise hand over one embed_batch_size piece at a time
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=2)
+    assert embed_model.get_text_embedding_batch(texts) == [fake_embedding(text) for text in texts]
+    assert requests == [["a", "cc"], ["eee", "bbbbb"], ["ddddddd"]]
+
+    requests.clear()
+    memgpt.embeddings._CACHE_POOL.clear()
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=2)
+    assert asyncio.run(embed_model.aget_text_embedding_batch(texts)) == [fake_embedding(text) for text in texts]
+    assert requests == [["a", "cc"], ["eee", "bbbbb"], ["ddddddd"]]
+
+
+def test_get_text_embedding_batch_shows_progress(monkeypatch, capsys):
+    async def fake_acall_api_batch(self, texts, client, sem):
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_acall_api_batch", fake_acall_api_batch)
+    monkeypatch.setattr(EmbeddingEndpoint, "_call_api_batch", lambda self, texts: [fake_embedding(text) for text in texts])
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=2, cache_size=0)
+    texts = ["a", "bbbbb", "cc", "ddddddd", "eee"]
+    # concurrently, through the sync client (a single batch), and from a running loop
+    for embed in [
+        lambda: embed_model.get_text_embedding_batch(texts, show_progress=True),
+        lambda: embed_model.get_text_embedding_batch(texts[:2], show_progress=True),
+        lambda: asyncio.run(embed_model.aget_text_embedding_batch(texts, show_progress=True)),
+    ]:
+        embed()
+        assert "Generating embeddings" in capsys.readouterr().err
+
+    embed_model.get_text_embedding_batch(texts)
+    assert capsys.readouterr().err == ""
+
+
+def test_get_text_embeddings_inside_running_loop(monkeypatch):
+    def fake_call_api_batch(self, texts):
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_call_api_batch", fake_call_api_batch)
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=2)
+    texts = ["a", "bbbbb", "cc", "ddddddd", "eee"]
+
+    async def embed_from_loop():
+        return embed_model._get_text_embeddings(texts)
+
+    assert asyncio.run(embed_from_loop()) == [fake_embedding(text) for text in texts]
+
+
+def test_single_batch_uses_sync_client(monkeypatch):
+    requests = []
+
+    def fake_call_api_batch(self, texts):
+        requests.append(texts)
+        return [fake_embedding(text) for text in texts]
+
+    async def fail_abatch(self, texts):
+        raise AssertionError("a single batch shouldn't start an event loop")
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_call_api_batch", fake_call_api_batch)
+    monkeypatch.setattr(EmbeddingEndpoint, "_abatch", fail_abatch)
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=2)
+    assert embed_model.get_text_embedding_batch(["bbbbb", "a"]) == [fake_embedding("bbbbb"), fake_embedding("a")]
+    assert requests == [["a", "bbbbb"]]
+
+
+def test_run_async_uvloop(monkeypatch):
+    loops = []
+
+    def new_event_loop():
+        loop = asyncio.new_event_loop()
+        loops.append(loop)
+        return loop
+
+    async def running_loop():
+        return asyncio.get_running_loop()
+
+    monkeypatch.setattr(memgpt.embeddings, "USE_UVLOOP", True)
+    monkeypatch.setitem(sys.modules, "uvloop", types.SimpleNamespace(new_event_loop=new_event_loop))
+    assert memgpt.embeddings._run_async(running_loop()) is loops[0]
+    assert loops[0].is_closed()
+
+    # falls back to asyncio's default loop if uvloop isn't installed
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+    assert memgpt.embeddings._run_async(running_loop()) not in loops
+
+
+def test_abatch_bounds_concurrency(monkeypatch):
+    import httpx
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_post(self, url, json=None, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, json=[fake_embedding(text) for text in json["input"]])
+
+    monkeypatch.setattr(httpx.AsyncClient, "post", fake_post)
+
+    embed_model = EmbeddingEndpoint(
+        model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=1, max_concurrency=2
+    )
+    texts = ["a", "bb", "ccc", "dddd", "eeeee", "ffffff"]
+    assert embed_model._get_text_embeddings(texts) == [fake_embedding(text) for text in texts]
+    assert max_in_flight == 2
+
+
+def test_endpoint_shared_between_threads(monkeypatch):
+    import httpx
+    from concurrent.futures import ThreadPoolExecutor
+
+    async def fake_post(self, url, json=None, **kwargs):
+        await asyncio.sleep(0.01)
+        # each thread's event loop must keep its own client open until its requests are done
+        assert not self.is_closed
+        return httpx.Response(200, json=[fake_embedding(text) for text in json["input"]])
+
+    monkeypatch.setattr(httpx.AsyncClient, "post", fake_post)
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", embed_batch_size=1)
+    texts = [[str(i) * length for length in range(1, 5)] for i in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(embed_model._get_text_embeddings, texts))
+    assert results == [[fake_embedding(text) for text in thread_texts] for thread_texts in texts]
+
+
+def test_get_text_embedding_returns_array(monkeypatch):
+    monkeypatch.setattr(EmbeddingEndpoint, "_call_api", lambda self, text: fake_embedding(text))
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test")
+    embedding = embed_model.get_text_embedding("abc")
+    assert isinstance(embedding, np.ndarray) and embedding.dtype == np.float32
+    assert embedding.tolist() == fake_embedding("abc")
+
+
+def test_query_embedding_is_padded():
+    class FakeEmbedModel:
+        def get_text_embedding(self, text):
+            return [0.5, -0.25, 1.0]
+
+    query_vec = query_embedding(FakeEmbedModel(), "query")
+    assert query_vec.shape == (MAX_EMBEDDING_DIM,)
+    assert query_vec[:3].tolist() == [0.5, -0.25, 1.0]
+    assert not query_vec[3:].any()
+
+
+def test_pad_embedding_numba():
+    numba = pytest.importorskip("numba")
+    assert isinstance(memgpt.embeddings._pad_embedding, numba.core.registry.CPUDispatcher)
+
+    vec = np.array([0.5, -0.25, 1.0], dtype=np.float32)
+    out = np.full(MAX_EMBEDDING_DIM, np.nan, dtype=np.float32)
+    memgpt.embeddings._pad_embedding(vec, out)
+    assert out[:3].tolist() == [0.5, -0.25, 1.0]
+    assert not out[3:].any()
+
+
+def test_embeddings_are_cached(monkeypatch):
+    requests = []
+
+    def fake_call_api_batch(self, texts):
+        requests.append(texts)
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_call_api_batch", fake_call_api_batch)
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test")
+
+    async def embed_from_loop(texts):
+        return embed_model._get_text_embeddings(texts)
+
+    assert asyncio.run(embed_from_loop(["a", "bb"])) == [fake_embedding("a"), fake_embedding("bb")]
+    assert asyncio.run(embed_from_loop(["bb", "ccc", "a"])) == [fake_embedding("bb"), fake_embedding("ccc"), fake_embedding("a")]
+    assert requests == [["a", "bb"], ["ccc"]]
+
+    # shared with other endpoints for the same server and model
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test")
+    assert asyncio.run(embed_from_loop(["ccc", "dddd"])) == [fake_embedding("ccc"), fake_embedding("dddd")]
+    assert requests == [["a", "bb"], ["ccc"], ["dddd"]]
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8081", user="test")
+    assert asyncio.run(embed_from_loop(["a"])) == [fake_embedding("a")]
+    assert requests == [["a", "bb"], ["ccc"], ["dddd"], ["a"]]
+
+    # but not with endpoints that asked for no cache
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", cache_size=0)
+    assert embed_model._cache.maxsize == 0
+    assert asyncio.run(embed_from_loop(["a"])) == [fake_embedding("a")]
+    assert asyncio.run(embed_from_loop(["a"])) == [fake_embedding("a")]
+    assert requests == [["a", "bb"], ["ccc"], ["dddd"], ["a"], ["a"], ["a"]]
+
+
+def test_cache_hits_match_misses(monkeypatch):
+    # values that don't survive half precision (the last one overflows it)
+    embedding = [0.1234567, -0.7654321, 70000.0]
+    monkeypatch.setattr(EmbeddingEndpoint, "_call_api", lambda self, text: embedding)
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test")
+    miss = embed_model.get_text_embedding("a")
+    hit = embed_model.get_text_embedding("a")
+    assert hit.tolist() == miss.tolist() and np.isfinite(hit).all()
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(maxsize=2)
+    keys = [EmbeddingCache.key("http://localhost:8080", "test-model", text) for text in ["a", "b", "c"]]
+    cache.put(keys[0], np.zeros(2, dtype=np.float32))
+    cache.put(keys[1], np.zeros(2, dtype=np.float32))
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], np.zeros(2, dtype=np.float32))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.get(keys[0]).dtype == np.float32
+    assert EmbeddingCache.key("http://localhost:8080", "other-model", "a") != keys[0]
+    assert EmbeddingCache.key("http://localhost:8081", "test-model", "a") != keys[0]
+
+
+def test_embedding_cache_disk_hits_are_read_only():
+    class FakeDisk(dict):
+        set = dict.__setitem__
+
+    cache = EmbeddingCache(maxsize=2)
+    cache._disk = FakeDisk()
+    key = EmbeddingCache.key("http://localhost:8080", "test-model", "a")
+    # as loaded back from disk (unpickled arrays are writable)
+    cache._disk[key] = np.ones(2, dtype=np.float16)
+
+    assert cache.get(key).tolist() == [1.0, 1.0]
+    assert not cache._memory[key].flags.writeable
+
+
+def test_batched_inference_embedding(monkeypatch):
+    from concurrent.futures import Future
+
+    class FakeBatchedInference:
+        def __init__(self, model_id, engine, device):
+            self.model_id = model_id
+            self.stopped = False
+
+        def stop(self):
+            self.stopped = True
+
+        def embed(self, sentences, model_id):
+            future = Future()
+            future.set_result(([np.array(fake_embedding(text)) for text in sentences], 0))
+            return future
+
+    monkeypatch.setitem(sys.modules, "embed", types.SimpleNamespace(BatchedInference=FakeBatchedInference))
+
+    embed_model = BatchedInferenceEmbedding(model="BAAI/bge-small-en-v1.5", device="cpu")
+    texts = ["a", "bb"]
+    assert embed_model.get_text_embedding("abc").tolist() == fake_embedding("abc")
+    assert embed_model.get_text_embedding_batch(texts) == [fake_embedding(text) for text in texts]
+    assert asyncio.run(embed_model.aget_text_embedding_batch(texts)) == [fake_embedding(text) for text in texts]
+
+    # the engine is loaded once per process, and stopped at exit
+    register = embed_model._register
+    assert BatchedInferenceEmbedding(model="BAAI/bge-small-en-v1.5", device="cpu")._register is register
+    memgpt.embeddings._stop_batched_inference()
+    assert register.stopped and not memgpt.embeddings._INFERENCE_POOL
+
+
+def test_coalescing_endpoint_batches_concurrent_requests(monkeypatch):
+    requests = []
+
+    async def fake_acall_api_batch(self, texts, client, sem):
+        requests.append(texts)
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_acall_api_batch", fake_acall_api_batch)
+
+    endpoint = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test")
+    coalescer = CoalescingEmbeddingEndpoint(endpoint, max_batch_size=4)
+    texts = ["a", "bb", "ccc", "dddd", "eeeee", "a"]
+
+    async def embed_all():
+        embeddings = await asyncio.gather(*[coalescer.embed(text) for text in texts])
+        # served from the cache
+        embeddings.append(await coalescer.embed("bb"))
+        await coalescer.aclose()
+        return embeddings
+
+    embeddings = asyncio.run(embed_all())
+    assert [embedding.tolist() for embedding in embeddings] == [fake_embedding(text) for text in texts + ["bb"]]
+    assert requests == [["a", "bb", "ccc", "dddd"], ["eeeee", "a"]]
+
+
+def test_coalescing_endpoint_is_bound_to_one_loop(monkeypatch):
+    async def fake_acall_api_batch(self, texts, client, sem):
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_acall_api_batch", fake_acall_api_batch)
+
+    endpoint = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test", cache_size=0)
+    coalescer = CoalescingEmbeddingEndpoint(endpoint)
+
+    async def embed(close):
+        embedding = await coalescer.embed("a")
+        if close:
+            await coalescer.aclose()
+        return embedding.tolist()
+
+    # reusable on a new loop once closed
+    assert asyncio.run(embed(close=True)) == fake_embedding("a")
+    assert asyncio.run(embed(close=False)) == fake_embedding("a")
+    # but not while its client is still open on the old one
+    client = coalescer._client
+    with pytest.raises(RuntimeError):
+        asyncio.run(embed(close=False))
+    assert coalescer._client is client
+
+
+def test_coalescing_endpoint_aclose_fails_pending_requests(monkeypatch):
+    async def fake_acall_api_batch(self, texts, client, sem):
+        return [fake_embedding(text) for text in texts]
+
+    monkeypatch.setattr(EmbeddingEndpoint, "_acall_api_batch", fake_acall_api_batch)
+
+    endpoint = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test")
+    # wait long enough for the requests to still be queued when the endpoint is closed
+    coalescer = CoalescingEmbeddingEndpoint(endpoint, max_wait_ms=10_000)
+
+    async def close_with_pending_requests():
+        tasks = [asyncio.ensure_future(coalescer.embed(text)) for text in ["a", "bb", "ccc", "dddd", "eeeee", "ffffff"]]
+        await asyncio.sleep(0.01)
+        await coalescer.aclose()
+        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=1)
+
+    results = asyncio.run(close_with_pending_requests())
+    assert len(results) == 6 and all(isinstance(result, RuntimeError) for result in results)
+
+
+class FakeEncoding:
+    """Byte-level stand-in for a tiktoken encoding (one token per UTF-8 byte)"""
+
+    max_length = 10
+
+    def encode(self, text):
+        return list(text.encode())
+
+    def decode(self, tokens):
+        return bytes(tokens).decode(errors="replace")
+
+    def decode_single_token_bytes(self, token):
+        return bytes([token])
+
+
+class FakeTokenDaggerTokenizer:
+    """Byte-level stand-in for a TokenDagger tokenizer, which has decode_bytes but no decode_single_token_bytes"""
+
+    max_length = 10
+
+    def encode(self, text):
+        return list(text.encode())
+
+    def decode(self, tokens):
+        return bytes(tokens).decode(errors="replace")
+
+    def decode_bytes(self, tokens):
+        return bytes(tokens)
+
+
+def test_check_and_split_text_splits_long_text(monkeypatch):
+    monkeypatch.setattr(memgpt.embeddings, "_get_encoding", lambda encoding_name: FakeEncoding())
+
+    assert check_and_split_text("short text", "text-embedding-ada-002") == ["short text"]
+    # windows of 10 tokens, overlapping by 1
+    assert check_and_split_text("abcdefghijk", "text-embedding-ada-002") == ["abcdefghij", "jk"]
+    assert check_and_split_text("abcdefghijklmnopqrstuvwxyz", "text-embedding-ada-002") == ["abcdefghij", "jklmnopqrs", "stuvwxyz"]
+
+    # texts longer than the pieces they are encoded in
+    long_text = "".join(chr(ord("a") + i % 26) for i in range(200))
+    chunks = check_and_split_text(long_text, "text-embedding-ada-002")
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert "".join(chunk[1:] for chunk in chunks[1:]) == long_text[10:]
+
+
+@pytest.mark.parametrize("encoding_class", [FakeEncoding, FakeTokenDaggerTokenizer])
+def test_check_and_split_text_keeps_characters_whole(monkeypatch, encoding_class):
+    monkeypatch.setattr(memgpt.embeddings, "_get_encoding", lambda encoding_name: encoding_class())
+
+    # 2 and 3 byte characters, which a window edge every 10 bytes would otherwise cut through
+    text = "aé€" * 20
+    chunks = check_and_split_text(text, "text-embedding-ada-002")
+    assert all("\ufffd" not in chunk and len(chunk.encode()) <= 10 for chunk in chunks)
+
+    chunks = check_and_split_text(text, "text-embedding-ada-002", stride=0)
+    assert all("\ufffd" not in chunk and len(chunk.encode()) <= 10 for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_get_encoding_uses_tokendagger(monkeypatch):
+    class FakeTiktokenEncoding(FakeEncoding):
+        name = "cl100k_base"
+        _pat_str = "pattern"
+        _mergeable_ranks = {b"a": 0}
+        _special_tokens = {"<|endoftext|>": 1}
+
+    class FakeTokenizer(FakeEncoding):
+        def __init__(self, name, pat_str, mergeable_ranks, special_tokens):
+            self.args = (name, pat_str, mergeable_ranks, special_tokens)
+
+    class BrokenTokenizer:
+        def __init__(self, **kwargs):
+            raise ValueError("unsupported encoding")
+
+    monkeypatch.setattr(memgpt.embeddings, "tiktoken", types.SimpleNamespace(get_encoding=lambda name: FakeTiktokenEncoding()))
+    monkeypatch.setattr(memgpt.embeddings, "tokendagger", types.SimpleNamespace(Tokenizer=FakeTokenizer))
+    memgpt.embeddings._get_encoding.cache_clear()
+    try:
+        encoding = memgpt.embeddings._get_encoding("cl100k_base")
+        assert isinstance(encoding, FakeTokenizer)
+        assert encoding.args == ("cl100k_base", "pattern", {b"a": 0}, {"<|endoftext|>": 1})
+        assert memgpt.embeddings._get_encoding("cl100k_base") is encoding
+
+        # falls back to tiktoken if TokenDagger can't build the tokenizer
+        monkeypatch.setattr(memgpt.embeddings, "tokendagger", types.SimpleNamespace(Tokenizer=BrokenTokenizer))
+        memgpt.embeddings._get_encoding.cache_clear()
+        assert isinstance(memgpt.embeddings._get_encoding("cl100k_base"), FakeTiktokenEncoding)
+    finally:
+        memgpt.embeddings._get_encoding.cache_clear()
+
+
+def test_sync_client_is_shared_between_endpoints(monkeypatch):
+    import httpx
+
+    urls = []
+
+    def handler(request):
+        urls.append(str(request.url))
+        return httpx.Response(200, json=[fake_embedding(text) for text in json.loads(request.content)["input"]])
+
+    first = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080/v1", user="test")
+    second = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080/v1", user="test")
+    client = memgpt.embeddings._get_client(first._base_url, first._timeout)
+    assert client is memgpt.embeddings._get_client(second._base_url, second._timeout)
+
+    monkeypatch.setattr(client, "_transport", httpx.MockTransport(handler))
+    assert first._call_api_batch(["a"]) == [fake_embedding("a")]
+    assert second._call_api_batch(["bb"]) == [fake_embedding("bb")]
+    assert urls == ["http://localhost:8080/v1/embeddings", "http://localhost:8080/v1/embeddings"]
+
+
+@pytest.mark.parametrize("decoder", ["msgspec", "orjson", "json"])
+def test_parse_responses(monkeypatch, decoder):
+    import httpx
+
+    # every decoder has to accept (and reject) the same payloads
+    if decoder == "msgspec":
+        pytest.importorskip("msgspec")
+    else:
+        monkeypatch.setattr(memgpt.embeddings, "msgspec", None)
+        if decoder == "orjson":
+            pytest.importorskip("orjson")
+        else:
+            monkeypatch.setattr(memgpt.embeddings, "orjson", None)
+
+    embed_model = EmbeddingEndpoint(model="test-model", base_url="http://localhost:8080", user="test")
+    openai_style = {
+        "object": "list",
+        "data": [{"object": "embedding", "index": 1, "embedding": [2.0]}, {"object": "embedding", "index": 0, "embedding": [1.0]}],
+        "model": "test-model",
+    }
+    openai_style_single = {"object": "list", "data": [{"object": "embedding", "index": 0, "embedding": [1.0, 2.0]}]}
+
+    assert embed_model._parse_response(httpx.Response(200, json=[1.0, 2.0])) == [1.0, 2.0]
+    assert embed_model._parse_response(httpx.Response(200, json=[[1.0, 2.0]])) == [1.0, 2.0]
+    assert embed_model._parse_response(httpx.Response(200, json=openai_style_single)) == [1.0, 2.0]
+    assert embed_model._parse_batch(httpx.Response(200, json=[[1.0], [2.0]]), 2) == [[1.0], [2.0]]
+    assert embed_model._parse_batch(httpx.Response(200, json=openai_style), 2) == [[1.0], [2.0]]
+
+    for payload in [{"error": "bad request"}, {"data": [{"index": 0}]}, "bad request", []]:
+        with pytest.raises(TypeError):
+            embed_model._parse_response(httpx.Response(200, json=payload))
+        with pytest.raises(TypeError):
+            embed_model._parse_batch(httpx.Response(200, json=payload), 2)
+    with pytest.raises(TypeError):
+        embed_model._parse_batch(httpx.Response(200, json=[[1.0]]), 2)
+    with pytest.raises(TypeError):
+        embed_model._parse_batch(httpx.Response(200, json=openai_style), 1)